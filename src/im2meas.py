@@ -1,13 +1,23 @@
+import math
 import openpifpaf
+import torch
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 from src.utils.find_body_parts import *
 from src.utils.image_config import *
 from src.utils.perimeter_calculator import *
 from src.utils.generate_yml import generate_yml
 
+# every batch has the same padded size so cuDNN can keep the fastest convolution algorithm it found
+torch.backends.cudnn.benchmark = True
 
 
+def _dist(point1: np.ndarray, point2: np.ndarray):
+    """
+    Distance between two points of the image
+    """
+    return math.hypot(point1[0] - point2[0], point1[1] - point2[1])
 
 
 class YeadonModel:
@@ -19,6 +29,9 @@ class YeadonModel:
         A dictionary containing the keypoints of the image. (Ls0, Ls1, ...)
     """
 
+    # openpifpaf predictor, created by the first YeadonModel
+    _predictor = None
+
     def __init__(self,
                  impath_front: str,
                  impath_pike: str,
@@ -29,7 +42,8 @@ class YeadonModel:
                  mass: float,
                  calibration: int,
                  distance: int,
-                 luminosity: int):
+                 luminosity: int,
+                 use_rembg: int = 1):
         """Creates a YeadonModel object from an image path.
 
         Parameters
@@ -42,62 +56,63 @@ class YeadonModel:
             The path to the tuck image to be processed.
         impath_r_tuck : str
             The path to the right tuck image to be processed.
+        use_rembg : int
+            1 to remove the background with rembg, 0 to use OpenCV GrabCut (no model needed, less precise).
         Returns
         -------
         YeadonModel
             The YeadonModel object with the key points of the image.
         """
+        # the five images are independent so their background removal runs concurrently,
+        # rembg (onnxruntime) and opencv release the GIL while they work
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            front = executor.submit(create_resize_remove_im_front, impath_front, calibration, rotation, luminosity, use_rembg)
+            r_side = executor.submit(create_resize_remove_im, impath_side, calibration, rotation, use_rembg)
+            tuck = executor.submit(create_resize_remove_im, impath_tuck, calibration, rotation, use_rembg)
+            r_tuck = executor.submit(create_resize_remove_im, impath_r_tuck, calibration, rotation, use_rembg)
+            pike = executor.submit(create_resize_remove_im, impath_pike, calibration, rotation, use_rembg)
         # front
-        pil_im, image, im, original_img, min_ratio = create_resize_remove_im_front(impath_front, calibration, rotation, luminosity)
-        edges = thresh(im, image, 2)
+        pil_im, image, im, original_img, min_ratio = front.result()
+        # right side
+        pil_r_side_im, image_r_side, im_r_side, original_img_side, min_ratio_side = r_side.result()
+        # front tuck
+        pil_tuck_im, image_tuck, im_tuck, original_img_tuck, min_ratio_tuck = tuck.result()
+        # right side tuck
+        pil_l_tuck_im, image_r_tuck, im_l_tuck, original_img_l_tuck, min_ratio_l_tuck = r_tuck.result()
+        # pike
+        pil_pike_im, image_pike, im_pike, original_img_pike, min_ratio_pike = pike.result()
+        img = Image.fromarray(image_pike)
+        img.save("t.jpg")
 
-        # edges short was for the edges for the hip to the knee because the original detection had some difficulty to detect the black of the short
-        edges_short = thresh(im, image, 2)
-        predictor = openpifpaf.Predictor(checkpoint="shufflenetv2k30-wholebody")
-        predictions, gt_anns, image_meta = predictor.pil_image(pil_im)
         # You can find the index here:
         # https://github.com/jin-s13/COCO-WholeBody/blob/master/imgs/Fig2_anno.png
         # as "predictions" is an array the index starts at 0 and not at 1 like in the github
-        data = predictions[0].data[:, 0:2]
-        edges = better_edges(edges, data)
-        edges_short = better_edges(edges_short, data)
+        data, data_r_side, data_tuck, data_l_tuck, data_pike = self._predict(
+            [pil_im, pil_r_side_im, pil_tuck_im, pil_l_tuck_im, pil_pike_im])
+
+        # front
+        edges = better_edges(thresh(im, image, 2), data)
+        # edges short was for the edges for the hip to the knee because the original detection had some difficulty to detect the black of the short
+        # they are currently extracted the same way, so the contours are only searched once
+        edges_short = edges.copy()
 
         self.ratio, self.ratio2 = get_ratio(original_img, min_ratio)
         self.ratio, self.ratio2 = get_new_ratio(distance, distance - 50, 150, self.ratio, self.ratio2)
         self.ratio_bottom, self.ratio_bottom2 = self.ratio2, self.ratio2
         # right side
-        pil_r_side_im, image_r_side, im_r_side, original_img_side, min_ratio = create_resize_remove_im(impath_side, calibration, rotation)
-
         edges_r_side = thresh(im_r_side, image_r_side, 1)
-        predictions2, gt_anns2, image_meta2 = predictor.pil_image(pil_r_side_im)
-        data_r_side = predictions2[0].data[:, 0:2]
-
-        self.ratio_r_side, self.ratio_r_side2 = get_ratio(original_img_side, min_ratio)
+        self.ratio_r_side, self.ratio_r_side2 = get_ratio(original_img_side, min_ratio_side)
         self.ratio_r_side, self.ratio_r_side2 = get_new_ratio(distance, distance - 50, 150, self.ratio_r_side, self.ratio_r_side2)
         # front tuck
-        pil_tuck_im, image_tuck, im_tuck, original_img_tuck, min_ratio = create_resize_remove_im(impath_tuck, calibration, rotation)
-
         edges_tuck = thresh(im_tuck, image_tuck, 2)
-        predictions5, gt_anns5, image_meta5 = predictor.pil_image(pil_tuck_im)
-        data_tuck = predictions5[0].data[:, 0:2]
-        self.ratio_tuck, self.ratio_tuck2 = get_ratio(original_img_tuck, min_ratio)
+        self.ratio_tuck, self.ratio_tuck2 = get_ratio(original_img_tuck, min_ratio_tuck)
         self.ratio_tuck, self.ratio_tuck2 = get_new_ratio(distance, distance - 50, 150, self.ratio_tuck, self.ratio_tuck2)
-
         # right side tuck
-        pil_l_tuck_im, image_r_tuck, im_l_tuck, original_img_l_tuck, min_ratio = create_resize_remove_im(impath_r_tuck, calibration, rotation)
-
         edges_l_tuck = thresh(im_l_tuck, image_r_tuck, 2)
-        predictions6, gt_anns6, image_meta6 = predictor.pil_image(pil_l_tuck_im)
-        data_l_tuck = predictions6[0].data[:, 0:2]
-        self.ratio_r_tuck, self.ratio_r_tuck2 = get_ratio(original_img_l_tuck, min_ratio)
+        self.ratio_r_tuck, self.ratio_r_tuck2 = get_ratio(original_img_l_tuck, min_ratio_l_tuck)
         self.ratio_r_tuck, self.ratio_r_tuck2 = get_new_ratio(distance, distance - 50, 150, self.ratio_r_tuck, self.ratio_r_tuck2)
         # pike
-        pil_pike_im, image_pike, im_pike, original_img_pike, min_ratio = create_resize_remove_im(impath_pike, calibration, rotation)
-        img = Image.fromarray(image_pike)
-        img.save("t.jpg")
-        predictions3, gt_anns3, image_meta3 = predictor.pil_image(pil_pike_im)
-        data_pike = predictions3[0].data[:, 0:2]
-        self.ratio_pike, self.ratio_pike2 = get_ratio(original_img_pike, min_ratio)
+        self.ratio_pike, self.ratio_pike2 = get_ratio(original_img_pike, min_ratio_pike)
         self.ratio_pike, self.ratio_pike2 = get_new_ratio(distance, distance - 50, 150, self.ratio_pike, self.ratio_pike2)
         # front
         body_parts_index = {
@@ -130,7 +145,7 @@ class YeadonModel:
             "left_toe_nail": 17,
             "right_toe_nail": 20,
         }
-        bdy_part = {k: data[v] for k, v in body_parts_index.items()}
+        bdy_part = get_body_parts(data, body_parts_index)
         # right side
         body_parts_index_r = {
             "nose": 0,
@@ -146,7 +161,7 @@ class YeadonModel:
             "right_ankle": 16,
         }
 
-        bdy_part_r_side = {k: data_r_side[v] for k, v in body_parts_index_r.items()}
+        bdy_part_r_side = get_body_parts(data_r_side, body_parts_index_r)
         # front tuck
         body_parts_index_tuck = {
             "left_shoulder": 5,
@@ -165,7 +180,7 @@ class YeadonModel:
             "left_toe_nail": 17,
             "right_toe_nail": 20,
         }
-        bdy_part_tuck = {k: data_tuck[v] for k, v in body_parts_index_tuck.items()}
+        bdy_part_tuck = get_body_parts(data_tuck, body_parts_index_tuck)
         # left side tuck
         body_parts_index_r_tuck = {
             "right_ear": 4,
@@ -178,7 +193,7 @@ class YeadonModel:
             "right_heel": 22,
             "right_toe_nail": 20,
         }
-        bdy_part_r_tuck = {k: data_l_tuck[v] for k, v in body_parts_index_r_tuck.items()}
+        bdy_part_r_tuck = get_body_parts(data_l_tuck, body_parts_index_r_tuck)
         # pike
         body_parts_index_pike = {
             "right_knee": 14,
@@ -188,55 +203,53 @@ class YeadonModel:
             "right_elbow": 8,
 
         }
-        bdy_part_pike = {k: data_pike[v] for k, v in body_parts_index_pike.items()}
+        bdy_part_pike = get_body_parts(data_pike, body_parts_index_pike)
         #bdy_part_pike["right_mid_arm"] = (data_pike[6] + data_pike[8]) / 2
         if bdy_part_pike["right_knuckle"][0] < 0:
             bdy_part_pike["right_knuckle"] = bdy_part_pike["right_wrist"]
         bdy_part_pike["right_hand"] = (bdy_part_pike["right_wrist"] + bdy_part_pike["right_knuckle"]) / 2
 
         # front
-        bdy_part["left_nails"] = (data[102] + data[103]) / 2
-        bdy_part["right_nails"] = data[123]#(data[123] + data[124]) / 2
-        left_lowest_front_rib_approx = (data[5] + data[11] * 1.1) / 2.1
-        bdy_part["left_lowest_front_rib"] = left_lowest_front_rib_approx
-        right_lowest_front_rib_approx = (data[6] + data[12] * 1.1) / 2.1
-        bdy_part["right_lowest_front_rib"] = right_lowest_front_rib_approx
-
-        bdy_part["left_nipple"] = (left_lowest_front_rib_approx + data[5] * 1.4) / 2.4
-        bdy_part["right_nipple"] = (right_lowest_front_rib_approx + data[6] * 1.4) / 2.4
-        bdy_part["left_umbiculus"] = ((left_lowest_front_rib_approx * 3.1) + (data[11] * 1.9)) / 5
-        bdy_part["right_umbiculus"] = ((right_lowest_front_rib_approx * 3.1) + (data[12] * 1.9)) / 5
-        left_arch_approx = (data[17] + data[19]) / 2
-        bdy_part["left_arch"] = left_arch_approx
-        right_arch_approx = (data[20] + data[22]) / 2
-        bdy_part["right_arch"] = right_arch_approx
-        bdy_part["left_ball"] = (data[17] + left_arch_approx) / 2
-        bdy_part["right_ball"] = (data[20] + right_arch_approx) / 2
-        bdy_part["left_mid_arm"] = (data[5] + data[7]) / 2
-        bdy_part["right_mid_arm"] = (data[6] + data[8]) / 2
-        bdy_part["left_shoulder_perimeter_width"] = (data[5] * 1.3 + bdy_part["left_mid_arm"]) / 2.3
-        bdy_part["right_shoulder_perimeter_width"] = (data[6] * 1.3 + bdy_part["right_mid_arm"]) / 2.3
+        bdy_part.update(get_front_landmarks(data))
         bdy_part["left_acromion"] = find_acromion_left(edges, data, 0)
         bdy_part["right_acromion"] = find_acromion_right(edges, data[0], data[6], 0)
         bdy_part["left_acromion_height"] = find_acromion_left(edges, data, 1)
         bdy_part["right_acromion_height"] = find_acromion_right(edges, data[0], data[6], 1)
         bdy_part["top_of_head"] = find_top_of_head(data, edges)
-        bdy_part["left_mid_elbow_wrist"] = (data[9] + data[7]) / 2
-        bdy_part["right_mid_elbow_wrist"] = (data[10] + data[8]) / 2
         bdy_part["right_maximum_forearm"] = np.array(get_max_pt(data[8], bdy_part["right_mid_elbow_wrist"], edges))
         bdy_part["left_maximum_forearm"] = np.array(get_max_pt(data[7], bdy_part["left_mid_elbow_wrist"], edges))
         #bdy_part["right_maximum_calf"] = np.array(get_max_pt(data[14] + np.array([0, 5]), data[16], edges))
         #bdy_part["left_maximum_calf"] = np.array(get_max_pt(data[13] + np.array([0, 5]), data[15], edges))
-        bdy_part["right_maximum_calf"] = (data[14] + data[16]) / 2
-        bdy_part["left_maximum_calf"] = (data[13] + data[15]) / 2
         bdy_part["right_crotch"], bdy_part["left_crotch"] = get_crotch_right_left(edges_short, data)
         bdy_part["right_mid_thigh"], bdy_part["left_mid_thigh"] = get_mid_thigh_right_left(data, bdy_part["right_crotch"], bdy_part["left_crotch"])
-        bdy_part["left_wrist_width"] = max_perp(bdy_part["left_wrist"], bdy_part["left_elbow"], edges, image)
-        bdy_part["right_wrist_width"] = max_perp(bdy_part["right_wrist"], bdy_part["right_elbow"], edges, image)
-        bdy_part["left_nails_width"] = max_perp(bdy_part["left_nails"], bdy_part["left_wrist"], edges, image)
-        bdy_part["right_nails_width"] = max_perp(bdy_part["right_nails"], bdy_part["right_wrist"], edges, image)
-        bdy_part["left_knuckles_width"] = max_perp(bdy_part["left_knuckles"], bdy_part["left_wrist"], edges, image)
-        bdy_part["right_knuckles_width"] = max_perp(bdy_part["right_knuckles"], bdy_part["right_wrist"], edges, image)
+        # the perpendicular widths measured on the front edges are computed in one batch
+        perp_segments = {
+            "left_wrist": (bdy_part["left_wrist"], bdy_part["left_elbow"]),
+            "right_wrist": (bdy_part["right_wrist"], bdy_part["right_elbow"]),
+            "left_nails": (bdy_part["left_nails"], bdy_part["left_wrist"]),
+            "right_nails": (bdy_part["right_nails"], bdy_part["right_wrist"]),
+            "left_knuckles": (bdy_part["left_knuckles"], bdy_part["left_wrist"]),
+            "right_knuckles": (bdy_part["right_knuckles"], bdy_part["right_wrist"]),
+            "left_shoulder_perimeter_width": (bdy_part["left_shoulder_perimeter_width"], bdy_part["left_shoulder"]),
+            "right_shoulder_perimeter_width": (bdy_part["right_shoulder_perimeter_width"], bdy_part["right_shoulder"]),
+            "left_mid_arm": (bdy_part["left_mid_arm"], bdy_part["left_elbow"]),
+            "right_mid_arm": (bdy_part["right_mid_arm"], bdy_part["right_elbow"]),
+            "left_elbow": (bdy_part["left_elbow"], bdy_part["left_mid_arm"]),
+            "right_elbow": (bdy_part["right_elbow"], bdy_part["right_mid_arm"]),
+            "left_maximum_forearm": (bdy_part["left_maximum_forearm"], bdy_part["left_elbow"]),
+            "right_maximum_forearm": (bdy_part["right_maximum_forearm"], bdy_part["right_elbow"]),
+            "left_base_of_thumb": (bdy_part["left_base_of_thumb"], bdy_part["left_base_of_thumb"] + np.array([1, 0])),
+            "right_base_of_thumb": (bdy_part["right_base_of_thumb"], bdy_part["right_base_of_thumb"] + np.array([1, 0])),
+            "right_knee": (bdy_part["right_knee"], bdy_part["right_hip"]),
+            "right_maximum_calf": (bdy_part["right_maximum_calf"], bdy_part["right_knee"]),
+        }
+        perp = dict(zip(perp_segments, max_perps(list(perp_segments.values()), edges, image)))
+        bdy_part["left_wrist_width"] = perp["left_wrist"]
+        bdy_part["right_wrist_width"] = perp["right_wrist"]
+        bdy_part["left_nails_width"] = perp["left_nails"]
+        bdy_part["right_nails_width"] = perp["right_nails"]
+        bdy_part["left_knuckles_width"] = perp["left_knuckles"]
+        bdy_part["right_knuckles_width"] = perp["right_knuckles"]
         bdy_part["crotch_width"] = min(
             max_perp(bdy_part["left_crotch"], bdy_part["left_knee"], edges_short, image) * self.ratio_bottom,
             max_perp(bdy_part["right_crotch"], bdy_part["right_knee"], edges_short, image) * self.ratio_bottom)
@@ -264,9 +277,9 @@ class YeadonModel:
         bdy_part_tuck["left_wrist_width"] = max_perp(bdy_part_tuck["left_wrist"], bdy_part_tuck["left_elbow"], edges_tuck, image_tuck)
         bdy_part_tuck["left_mid_arm"] = (bdy_part_tuck["left_shoulder"] + bdy_part_tuck["left_elbow"]) / 2
         #print(circle_p(max_perp(bdy_part_tuck["left_mid_arm"], bdy_part_tuck["left_elbow"], edges_tuck, image_tuck) * self.ratio_tuck))
-        if np.linalg.norm(bdy_part_tuck["right_ankle"] - bdy_part_tuck["right_arch"]) * self.ratio_tuck < 6:
+        if _dist(bdy_part_tuck["right_ankle"], bdy_part_tuck["right_arch"]) * self.ratio_tuck < 6:
             bdy_part_tuck["right_arch"] = (bdy_part_tuck["right_ankle"] + bdy_part_tuck["right_toe_nail"]) / 2
-        if np.linalg.norm(bdy_part_tuck["right_ankle"] - bdy_part_tuck["right_ball"]) * self.ratio_tuck < 10:
+        if _dist(bdy_part_tuck["right_ankle"], bdy_part_tuck["right_ball"]) * self.ratio_tuck < 10:
             bdy_part_tuck["right_ball"] = (bdy_part_tuck["right_ankle"] + bdy_part_tuck["right_toe_nail"] * 2) / 3
         # left side tuck
         bdy_part_r_tuck["right_toe_nail"], dist = get_maximum_pit(data_l_tuck[16], edges_l_tuck)
@@ -290,7 +303,7 @@ class YeadonModel:
             "Ls1p": stad_p(max_line(bdy_part["left_umbiculus"], bdy_part["right_umbiculus"], edges, image) * self.ratio,
                            max_perp(bdy_part_r_side["right_umbiculus"], bdy_part_r_side["right_knee"], edges_r_side, image_r_side) * self.ratio_r_side),
             "Ls2p": stad_p(
-                max(max_line(bdy_part["right_lowest_front_rib"], bdy_part["left_lowest_front_rib"], edges, image), np.linalg.norm(bdy_part["right_lowest_front_rib"] - bdy_part["left_lowest_front_rib"])) * self.ratio,
+                max(max_line(bdy_part["right_lowest_front_rib"], bdy_part["left_lowest_front_rib"], edges, image), _dist(bdy_part["right_lowest_front_rib"], bdy_part["left_lowest_front_rib"])) * self.ratio,
                 max_perp(bdy_part_r_side["right_lowest_front_rib"], bdy_part_r_side["right_hip"], edges_r_side, image_r_side) * self.ratio_r_side
             ),
             "Ls3p": stad_p(max_line(bdy_part["right_nipple"], bdy_part["left_nipple"], edges, image) * self.ratio,
@@ -302,11 +315,11 @@ class YeadonModel:
 
             "Ls0w": max_line(bdy_part["left_hip"], bdy_part["right_hip"], edges_short, image) * self.ratio,
             "Ls1w": max(max_line(bdy_part["left_umbiculus"], bdy_part["right_umbiculus"], edges, image) * self.ratio,
-                        np.linalg.norm(bdy_part["left_umbiculus"] - bdy_part["right_umbiculus"]) * self.ratio),
+                        _dist(bdy_part["left_umbiculus"], bdy_part["right_umbiculus"]) * self.ratio),
             "Ls2w": max(max_line(bdy_part["left_lowest_front_rib"], bdy_part["right_lowest_front_rib"], edges, image) * self.ratio,
-                        np.linalg.norm(bdy_part["left_lowest_front_rib"] - bdy_part["right_lowest_front_rib"]) * self.ratio),
+                        _dist(bdy_part["left_lowest_front_rib"], bdy_part["right_lowest_front_rib"]) * self.ratio),
             "Ls3w": max(max_line(bdy_part["left_nipple"], bdy_part["right_nipple"], edges, image) * self.ratio,
-                        np.linalg.norm(bdy_part["left_nipple"] - bdy_part["right_nipple"]) * self.ratio),
+                        _dist(bdy_part["left_nipple"], bdy_part["right_nipple"]) * self.ratio),
             "Ls4w": get_length(bdy_part["left_shoulder"], bdy_part["right_shoulder"], image) * self.ratio,
 
             "Ls4d": max_perp(bdy_part_r_side["right_shoulder"], bdy_part_r_side["right_elbow"], edges_r_side, image_r_side) * self.ratio_r_side,
@@ -319,22 +332,21 @@ class YeadonModel:
             "La6L": get_length(bdy_part["left_wrist"], bdy_part["left_knuckles"], image) * self.ratio,
             "La7L": get_length(bdy_part["left_wrist"], bdy_part["left_nails"], image) * self.ratio,
 
-            "La0p": circle_p(max_perp(bdy_part["left_shoulder_perimeter_width"], bdy_part["left_shoulder"], edges,
-                                      image)) * self.ratio2,
+            "La0p": circle_p(perp["left_shoulder_perimeter_width"]) * self.ratio2,
             "La1p": circle_p(min(max_perp(bdy_part_tuck["left_mid_arm"], bdy_part_tuck["left_elbow"], edges_tuck, image_tuck) * self.ratio_tuck,
-                                 max_perp(bdy_part["left_mid_arm"], bdy_part["left_elbow"], edges, image) * self.ratio)),
-            "La2p": circle_p(max_perp(bdy_part["left_elbow"], bdy_part["left_mid_arm"], edges, image)) * self.ratio2,
-            "La3p": circle_p(max_perp(bdy_part["left_maximum_forearm"], bdy_part["left_elbow"], edges, image)) * self.ratio2,
+                                 perp["left_mid_arm"] * self.ratio)),
+            "La2p": circle_p(perp["left_elbow"]) * self.ratio2,
+            "La3p": circle_p(perp["left_maximum_forearm"]) * self.ratio2,
             "La4p": stad_p(bdy_part["left_wrist_width"], bdy_part["left_wrist_width"] / 2) * self.ratio2,
             #"La4p": stad_p(bdy_part["left_wrist_width"] * self.ratio2, bdy_part_tuck["left_wrist_width"] * self.ratio_tuck) ,
-            "La5p": stad_p(max_perp(bdy_part["left_base_of_thumb"], bdy_part["left_base_of_thumb"] + np.array([1, 0]), edges, image) * self.ratio2, 0),
+            "La5p": stad_p(perp["left_base_of_thumb"] * self.ratio2, 0),
             "La6p": stad_p(bdy_part["left_knuckles_width"], bdy_part["left_knuckles_width"] / 3) * self.ratio2,
             "La7p": stad_p(bdy_part["left_nails_width"], bdy_part["left_nails_width"] / 3) * self.ratio2,
 
             "La4w": bdy_part["left_wrist_width"] * self.ratio2,
-            "La5w": max_perp(bdy_part["left_base_of_thumb"], bdy_part["left_base_of_thumb"] + np.array([1, 0]), edges, image) * self.ratio2,
-            "La6w": max_perp(bdy_part["left_knuckles"], bdy_part["left_wrist"], edges, image) * self.ratio2,
-            "La7w": max_perp(bdy_part["left_nails"], bdy_part["left_wrist"], edges, image) * self.ratio2,
+            "La5w": perp["left_base_of_thumb"] * self.ratio2,
+            "La6w": perp["left_knuckles"] * self.ratio2,
+            "La7w": perp["left_nails"] * self.ratio2,
 
             # Not needed"Lb1L": (np.linalg.norm(body_parts_pos["right_shoulder"] - body_parts_pos["right_elbow"])) / 2,
             "Lb2L": get_length(bdy_part["right_shoulder"], bdy_part["right_elbow"], image) * self.ratio,
@@ -344,37 +356,37 @@ class YeadonModel:
             "Lb6L": get_length(bdy_part["right_wrist"], bdy_part["right_knuckles"], image) * self.ratio,
             "Lb7L": get_length(bdy_part["right_wrist"], bdy_part["right_nails"], image) * self.ratio,
 
-            "Lb0p": circle_p(max_perp(bdy_part["right_shoulder_perimeter_width"], bdy_part["right_shoulder"], edges, image)) * self.ratio2,
+            "Lb0p": circle_p(perp["right_shoulder_perimeter_width"]) * self.ratio2,
             "Lb1p": circle_p(min(max_perp(bdy_part_tuck["left_mid_arm"], bdy_part_tuck["left_elbow"], edges_tuck, image_tuck) * self.ratio_tuck,
-                             max_perp(bdy_part["right_mid_arm"], bdy_part["right_elbow"], edges, image) * self.ratio)),
-            "Lb2p": circle_p(max_perp(bdy_part["right_elbow"], bdy_part["right_mid_arm"], edges, image)) * self.ratio2,
-            "Lb3p": circle_p(max_perp(bdy_part["right_maximum_forearm"], bdy_part["right_elbow"], edges, image)) * self.ratio2,
+                             perp["right_mid_arm"] * self.ratio)),
+            "Lb2p": circle_p(perp["right_elbow"]) * self.ratio2,
+            "Lb3p": circle_p(perp["right_maximum_forearm"]) * self.ratio2,
             "Lb4p": stad_p(bdy_part["right_wrist_width"], bdy_part["right_wrist_width"] / 2) * self.ratio2,
             #"Lb4p": stad_p(bdy_part["right_wrist_width"] * self.ratio2, bdy_part_tuck["left_wrist_width"] * self.ratio_tuck) ,
-            "Lb5p": stad_p(max_perp(bdy_part["right_base_of_thumb"], bdy_part["right_base_of_thumb"] + np.array([1, 0]), edges, image) * self.ratio2, 0),
+            "Lb5p": stad_p(perp["right_base_of_thumb"] * self.ratio2, 0),
             "Lb6p": stad_p(bdy_part["right_knuckles_width"], bdy_part["right_knuckles_width"] / 3) * self.ratio2,
             "Lb7p": stad_p(bdy_part["left_nails_width"], bdy_part["right_nails_width"] / 4) * self.ratio2,
 
             "Lb4w": bdy_part["right_wrist_width"] * self.ratio2,
-            "Lb5w": max_perp(bdy_part["right_base_of_thumb"], bdy_part["right_base_of_thumb"] + np.array([1, 0]), edges, image) * self.ratio2,
-            "Lb6w": max_perp(bdy_part["right_knuckles"], bdy_part["right_wrist"], edges, image) * self.ratio2,
-            "Lb7w": max_perp(bdy_part["right_nails"], bdy_part["right_wrist"], edges, image) * self.ratio2,
+            "Lb5w": perp["right_base_of_thumb"] * self.ratio2,
+            "Lb6w": perp["right_knuckles"] * self.ratio2,
+            "Lb7w": perp["right_nails"] * self.ratio2,
 
-            "Lj1L": np.linalg.norm(bdy_part["left_hip"] - bdy_part["left_crotch"]) * self.ratio_bottom,
+            "Lj1L": _dist(bdy_part["left_hip"], bdy_part["left_crotch"]) * self.ratio_bottom,
             # Not needed"Lj2L": (np.linalg.norm(body_parts_pos["left_hip"] - body_par&ts_pos["left_knee"])) / 2,
-            "Lj3L": np.linalg.norm(bdy_part["left_hip"] - bdy_part["left_knee"]) * self.ratio_bottom,
-            "Lj4L": np.linalg.norm(bdy_part["left_hip"] - bdy_part["left_maximum_calf"]) * self.ratio_bottom,
-            "Lj5L": np.linalg.norm(bdy_part_r_side["right_hip"] - bdy_part_r_side["right_ankle"]) * self.ratio_r_side,
+            "Lj3L": _dist(bdy_part["left_hip"], bdy_part["left_knee"]) * self.ratio_bottom,
+            "Lj4L": _dist(bdy_part["left_hip"], bdy_part["left_maximum_calf"]) * self.ratio_bottom,
+            "Lj5L": _dist(bdy_part_r_side["right_hip"], bdy_part_r_side["right_ankle"]) * self.ratio_r_side,
             "Lj6L": 1.0,
             # Not measured "Lj7L": np.linalg.norm(body_parts_pos["left_ankle"] - body_parts_pos["left_arch"]),
-            "Lj8L": np.linalg.norm(bdy_part_tuck["right_ankle"] - bdy_part_tuck["right_ball"]) * self.ratio_tuck2,
-            "Lj9L": np.linalg.norm(bdy_part_tuck["right_ankle"] - bdy_part_tuck["right_toe_nail"]) * self.ratio_tuck2,
+            "Lj8L": _dist(bdy_part_tuck["right_ankle"], bdy_part_tuck["right_ball"]) * self.ratio_tuck2,
+            "Lj9L": _dist(bdy_part_tuck["right_ankle"], bdy_part_tuck["right_toe_nail"]) * self.ratio_tuck2,
 
             # Not measured "Lj0p":,
             "Lj1p": circle_p(bdy_part["crotch_width"]),
             "Lj2p": circle_p(max_perp(bdy_part["right_mid_thigh"], bdy_part["right_hip"], edges_short, image)) * self.ratio_bottom,
-            "Lj3p": circle_p(max_perp(bdy_part["right_knee"], bdy_part["right_hip"], edges, image)) * self.ratio_bottom,
-            "Lj4p": circle_p(max_perp(bdy_part["right_maximum_calf"], bdy_part["right_knee"], edges, image)) * self.ratio_bottom,
+            "Lj3p": circle_p(perp["right_knee"]) * self.ratio_bottom,
+            "Lj4p": circle_p(perp["right_maximum_calf"]) * self.ratio_bottom,
             "Lj5p": circle_p(max_perp(bdy_part_tuck["right_ankle"], bdy_part_tuck["right_knee"], edges_tuck,image_tuck)) * self.ratio_tuck,
             "Lj6p": stad_p(max_perp(bdy_part_r_tuck["right_ankle"], bdy_part_r_tuck["right_toe_nail"], edges_l_tuck, image_r_tuck) * self.ratio_r_tuck,
                            max_perp(bdy_part_tuck["right_ankle"], bdy_part_tuck["right_toe_nail"], edges_tuck, image_tuck) * self.ratio_tuck),
@@ -403,8 +415,8 @@ class YeadonModel:
             # Not measured "Lk0p",
             "Lk1p": circle_p(bdy_part["crotch_width"]),
             "Lk2p": circle_p(max_perp(bdy_part["right_mid_thigh"], bdy_part["right_hip"], edges_short, image)) * self.ratio_bottom,
-            "Lk3p": circle_p(max_perp(bdy_part["right_knee"], bdy_part["right_hip"], edges, image)) * self.ratio_bottom,
-            "Lk4p": circle_p(max_perp(bdy_part["right_maximum_calf"], bdy_part["right_knee"], edges, image)) * self.ratio_bottom,
+            "Lk3p": circle_p(perp["right_knee"]) * self.ratio_bottom,
+            "Lk4p": circle_p(perp["right_maximum_calf"]) * self.ratio_bottom,
             "Lk5p": circle_p(max_perp(bdy_part_tuck["right_ankle"], bdy_part_tuck["right_knee"], edges_tuck, image_tuck)) * self.ratio_tuck,
             "Lk6p": stad_p(max_perp(bdy_part_r_tuck["right_ankle"], bdy_part_r_tuck["right_toe_nail"], edges_l_tuck, image_r_tuck) * self.ratio_r_tuck,
                            max_perp(bdy_part_tuck["right_ankle"], bdy_part_tuck["right_toe_nail"], edges_tuck, image_tuck) * self.ratio_tuck),
@@ -423,7 +435,7 @@ class YeadonModel:
         # For acrobatic model we need pelvis, knuckle, pike_hand and tuck_hand
         pelvis = abs(bdy_part["left_hip"][1] - bdy_part["top_of_head"][1]) * self.ratio / 100
         knuckle = self.keypoints["Lb6L"] / 100
-        pike_hand = np.linalg.norm(bdy_part_pike["right_knee"] - bdy_part_pike["right_hand"]) * self.ratio_pike / 100
+        pike_hand = _dist(bdy_part_pike["right_knee"], bdy_part_pike["right_hand"]) * self.ratio_pike / 100
         get_length(bdy_part_pike["right_knee"], bdy_part_pike["right_hand"], image_pike)
         tuck_hand = abs(bdy_part_r_tuck["right_knee"][1] - bdy_part_r_tuck["right_knuckle"][1]) * self.ratio_r_tuck / 100
         get_length(bdy_part_r_tuck["right_knee"], np.array([bdy_part_r_tuck["right_knee"][0], bdy_part_r_tuck["right_knuckle"][1]]), image_r_tuck)
@@ -433,6 +445,26 @@ class YeadonModel:
         self._create_txt(f"{impath_front.split('/')[-1].split('_')[0]}.txt", mass)
         self._verify_keypoints()
 
+    def _predict(self, pil_images: list):
+        """
+        Predict the keypoints [x, y] of each image with openpifpaf, the images go through the network as one batch
+        """
+        # the checkpoint is loaded once per process and shared by every YeadonModel
+        if YeadonModel._predictor is None:
+            # openpifpaf needs the long edge to pad every image of the batch to the same size
+            openpifpaf.Predictor.batch_size = len(pil_images)
+            openpifpaf.Predictor.long_edge = RESIZE_SIZE
+            # the images are already in memory, forking DataLoader workers to preprocess them costs more than it saves
+            openpifpaf.Predictor.loader_workers = 0
+            YeadonModel._predictor = openpifpaf.Predictor(checkpoint="shufflenetv2k30-wholebody")
+            # the decoder expects float32 fields whatever the precision the network ran in
+            YeadonModel._predictor.model.register_forward_hook(
+                lambda model, inputs, heads: tuple(head.float() for head in heads))
+        # no autograd graph is needed, and on GPU the convolutions run in half precision on the tensor cores
+        with torch.inference_mode(), \
+                torch.autocast(device_type="cuda", dtype=torch.float16, enabled=torch.cuda.is_available()):
+            return [predictions[0].data[:, 0:2] for predictions, gt_anns, image_meta in self._predictor.pil_images(pil_images)]
+
     def _create_txt(self, file_name: str, mass):
         """
         Create the .txt file of the person (Yeadon's model)
@@ -517,10 +549,12 @@ def main():
     # Used to change the distance between the camera and the wall just in case
     parser.add_argument("--distance", type=int, default=350, help="Enter the distance between the camera and the wall")
     parser.add_argument("-l", "--luminosity", type=int, default=0, help="Enter 1 if you want to increase the luminosity of the images")
+    # GrabCut does not need the U2-Net model but is less precise, especially on a cluttered background
+    parser.add_argument("--rembg", type=int, default=1, help="Enter 0 to remove the background with OpenCV GrabCut instead of rembg")
 
 
     args = parser.parse_args()
-    yeadon = YeadonModel(args.front_img, args.pike_img, args.right_tuck_img, args.side_img, args.tuck_img, args.rotation, args.mass, args.calibration, args.distance, args.luminosity)
+    yeadon = YeadonModel(args.front_img, args.pike_img, args.right_tuck_img, args.side_img, args.tuck_img, args.rotation, args.mass, args.calibration, args.distance, args.luminosity, args.rembg)
 
 
     return yeadon
@@ -21,6 +21,7 @@ class YeadonModelRequest(BaseModel):
     calibration: int
     distance: int
     luminosity: int
+    use_rembg: int = 1
 
 @app.post("/process_yeadon_model/")
 async def process_yeadon_model(request_data: YeadonModelRequest):
@@ -28,7 +29,7 @@ async def process_yeadon_model(request_data: YeadonModelRequest):
         yea = YeadonModel(request_data.impath_front, request_data.impath_pike, request_data.impath_r_tuck,
                           request_data.impath_side, request_data.impath_tuck,
                           request_data.rotation, request_data.mass, request_data.calibration,
-                          request_data.distance, request_data.luminosity)
+                          request_data.distance, request_data.luminosity, request_data.use_rembg)
         bioModOptions = "src/biomake/tech_opt.yml"
         name = f"{request_data.impath_front.split('/')[-1].split('_')[0]}"
         human = yeadon.Human(f"{name}.txt")
@@ -16,7 +16,7 @@ def _crop(image, position_1, position_2):
     Returns
     -------
     numpy array
-        The cropped image.
+        The cropped image, a view on the given image.
     """
     x1, y1 = map(int, position_1[0:2])
     x2, y2 = map(int, position_2[0:2])
@@ -24,5 +24,29 @@ def _crop(image, position_1, position_2):
         x2, x1 = x1, x2
     if y1 > y2:
         y2, y1 = y1, y2
-    x = image[y1:y2, x1:x2].copy()
-    return x
+    return image[y1:y2, x1:x2]
+
+
+def _first_nonzero(image, count):
+    """Return the position of the first nonzero pixels of an image, in row-major order.
+
+    Only the rows up to the last pixel found are scanned.
+
+    Parameters
+    ----------
+    image : numpy array
+        The image to be scanned.
+    count : int
+        The number of pixels to be found.
+
+    Returns
+    -------
+    list
+        The (row, column) of the first count nonzero pixels.
+    """
+    points = []
+    for row in np.flatnonzero(image.any(axis=1)):
+        points.extend((row, col) for col in np.flatnonzero(image[row]))
+        if len(points) >= count:
+            return points[:count]
+    raise IndexError("The image has less than %d nonzero pixels" % count)
@@ -1,8 +1,101 @@
+import math
+
 import numpy as np
 
-from src.utils.crop import _crop
+from src.utils.crop import _crop, _first_nonzero
 from src.utils.get_maximum import *
 
+def get_body_parts(data: np.ndarray, body_parts_index: dict):
+    """Gathers the keypoints used by a view in one contiguous block.
+
+    Parameters
+    ----------
+    data : numpy array
+        The keypoints of the image (given by openpifpaf WholeBody, predictions[0].data generally).
+    body_parts_index : dict
+        The index in data of each body part.
+
+    Returns
+    -------
+    dict
+        The coordinates of each body part, as rows of a single (n_body_parts, 2) array.
+    """
+    positions = data[list(body_parts_index.values())]
+    return dict(zip(body_parts_index, positions))
+
+
+# Landmarks of the front image approximated as weighted means of openpifpaf WholeBody keypoints,
+# a landmark can also be used in the landmarks defined after it.
+FRONT_LANDMARKS = {
+    "left_nails": {102: 1, 103: 1},
+    "right_nails": {123: 1},
+    "left_lowest_front_rib": {5: 1, 11: 1.1},
+    "right_lowest_front_rib": {6: 1, 12: 1.1},
+    "left_nipple": {"left_lowest_front_rib": 1, 5: 1.4},
+    "right_nipple": {"right_lowest_front_rib": 1, 6: 1.4},
+    "left_umbiculus": {"left_lowest_front_rib": 3.1, 11: 1.9},
+    "right_umbiculus": {"right_lowest_front_rib": 3.1, 12: 1.9},
+    "left_arch": {17: 1, 19: 1},
+    "right_arch": {20: 1, 22: 1},
+    "left_ball": {17: 1, "left_arch": 1},
+    "right_ball": {20: 1, "right_arch": 1},
+    "left_mid_arm": {5: 1, 7: 1},
+    "right_mid_arm": {6: 1, 8: 1},
+    "left_shoulder_perimeter_width": {5: 1.3, "left_mid_arm": 1},
+    "right_shoulder_perimeter_width": {6: 1.3, "right_mid_arm": 1},
+    "left_mid_elbow_wrist": {9: 1, 7: 1},
+    "right_mid_elbow_wrist": {10: 1, 8: 1},
+    "right_maximum_calf": {14: 1, 16: 1},
+    "left_maximum_calf": {13: 1, 15: 1},
+}
+
+
+def landmark_weights(landmarks: dict):
+    """Expands landmarks defined as weighted means into a single weight matrix.
+
+    Parameters
+    ----------
+    landmarks : dict
+        For each landmark, the weight of the keypoints (or of the previous landmarks) it is the mean of.
+
+    Returns
+    -------
+    numpy array
+        The index of the keypoints used by the landmarks.
+    numpy array
+        The weight matrix, one row per landmark and one column per keypoint index.
+    """
+    expanded = {}
+    for name, weights in landmarks.items():
+        total = sum(weights.values())
+        expanded[name] = {}
+        for part, weight in weights.items():
+            # a previous landmark is replaced by the weights of its own keypoints
+            part_weights = expanded[part] if isinstance(part, str) else {part: 1}
+            for index, part_weight in part_weights.items():
+                expanded[name][index] = expanded[name].get(index, 0) + weight * part_weight / total
+    index = np.array(sorted({i for weights in expanded.values() for i in weights}))
+    return index, np.array([[weights.get(i, 0) for i in index] for weights in expanded.values()])
+
+
+FRONT_LANDMARKS_INDEX, FRONT_LANDMARKS_WEIGHTS = landmark_weights(FRONT_LANDMARKS)
+
+
+def get_front_landmarks(data: np.ndarray):
+    """Computes all the FRONT_LANDMARKS with a single matrix product.
+
+    Parameters
+    ----------
+    data : numpy array
+        The keypoints of the front image (given by openpifpaf WholeBody, predictions[0].data generally).
+
+    Returns
+    -------
+    dict
+        The coordinates of each landmark in the image.
+    """
+    return dict(zip(FRONT_LANDMARKS, FRONT_LANDMARKS_WEIGHTS @ data[FRONT_LANDMARKS_INDEX]))
+
 
 def find_acromion_right(edges: np.ndarray, ear: np.ndarray, shoulder: np.ndarray, height: int):
     """Finds the acromion given an image and a set of keypoints.
@@ -23,17 +116,18 @@ def find_acromion_right(edges: np.ndarray, ear: np.ndarray, shoulder: np.ndarray
         The coordinates of the acromion in the image.
     """
 
-    cropped_img = _crop(edges, ear, shoulder)
     # crop the image between the ear and the shoulder
-    cropped_img[: int(len(cropped_img) / 2), :] = 0
+    cropped_img = _crop(edges, ear, shoulder)
+    # only the bottom half is scanned
+    top, width = int(len(cropped_img) / 2), len(cropped_img[0])
     # get the middle in the img
-    if height:
-        cropped_img[:, int(len(cropped_img[0]) / 2.5) :] = 0
-    reversed_image_array = np.fliplr(cropped_img)
+    right = int(width / 2.5) if height else width
+    # the first edge pixel from the top, and from the right in its row
+    [(row, col)] = _first_nonzero(cropped_img[top:, :right][:, ::-1], 1)
     acromion = np.array(
         [
-            ear[0] - (np.where(reversed_image_array == 255)[1][0]),
-            ear[1] + np.where(reversed_image_array == 255)[0][0],
+            ear[0] - (width - right + col),
+            ear[1] + (top + row),
         ]
     )
     return acromion
@@ -58,14 +152,16 @@ def find_acromion_left(edges: np.ndarray, data: np.ndarray, height: int):
     l_ear, l_shoulder = data[0], data[5]
     # crop the image between the ear and the shoulder
     cropped_img = _crop(edges, l_ear, l_shoulder)
-    cropped_img[: int(len(cropped_img) / 2), :] = 0
+    # only the bottom half is scanned
+    top = int(len(cropped_img) / 2)
     # get the middle in the img
-    if height:
-        cropped_img[:,:int(len(cropped_img[0])/1.5)] = 0
+    left = int(len(cropped_img[0]) / 1.5) if height else 0
+    # the first edge pixel from the top, and from the left in its row
+    [(row, col)] = _first_nonzero(cropped_img[top:, left:], 1)
     acromion = np.array(
         [
-            l_ear[0] + np.where(cropped_img == 255)[1][0],
-            l_ear[1] + np.where(cropped_img == 255)[0][0],
+            l_ear[0] + (left + col),
+            l_ear[1] + (top + row),
         ]
     )
     return acromion
@@ -88,11 +184,8 @@ def find_top_of_head(data: np.ndarray, edges: np.ndarray):
     """
     # the first pixel from top to bottom to find the top_of_head
     nose = data[0]
-    point = np.array([nose[1], nose[0]])
-    point2 = np.array([point[0] - 5, point[1]])
-    vector = np.array([point2[0] - point[0], point2[1] - point[1]])
-    angle_radians = np.arctan2(vector[1], vector[0])
-    top_of_head = find_edge(point, angle_radians, edges, save=[])
+    # the ray goes up the rows from the nose
+    top_of_head = find_edge((nose[1], nose[0]), math.pi, edges, save=[])
     return np.array(top_of_head[0])
 
 
@@ -114,10 +207,8 @@ def get_crotch_right_left(edges: np.ndarray, data: np.ndarray):
     # crop the image to see the right hip to the left knee
     crotch_zone = _crop(edges, data[12], data[13])
     # now the cropped image only has the crotch as an edge so we can get it like the head
-    crotch_approx_crop = (
-        np.where(crotch_zone != 0)[1][0],
-        np.where(crotch_zone != 0)[0][1],
-    )
+    first, second = _first_nonzero(crotch_zone, 2)
+    crotch_approx_crop = (first[1], second[0])
     crotch_approx_right, crotch_approx_left = np.array(
         [data[12][0], data[12][1] + crotch_approx_crop[1]]
     ), np.array([data[11][0], data[11][1] + crotch_approx_crop[1]])
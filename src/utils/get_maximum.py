@@ -1,31 +1,90 @@
+import math
+
 import numpy as np
 import cv2 as cv
+from numba import njit, prange
+
+PIT_STEP = 0.01  # the angle step (in radians) of the get_maximum_pit scan
+
+
+@njit(cache=True, boundscheck=False, error_model="numpy")
+def _axis_step(start, direction):
+    """
+    Direction of the pixel steps along one axis, distance along the ray to the first pixel line and between two lines.
+    """
+    if direction > 0:
+        return 1, (math.floor(start) + 1 - start) / direction, 1 / direction
+    if direction < 0:
+        return -1, (start - math.floor(start)) / -direction, -1 / direction
+    return 0, math.inf, math.inf
+
+
+@njit("Tuple((int64, int64, boolean))(float64, float64, float64, float64, uint8[:, ::1])",
+      cache=True, boundscheck=False, error_model="numpy")
+def _walk_ray(row, col, sin_a, cos_a, edges):
+    """
+    Walk every pixel crossed by the ray starting at (row, col) and return (row, col, hit) for the first edge pixel.
+    """
+    height, width = edges.shape
+    r, c = int(math.floor(row)), int(math.floor(col))
+    step_r, next_r, delta_r = _axis_step(row, cos_a)
+    step_c, next_c, delta_c = _axis_step(col, sin_a)
+    while 0 <= r < height and 0 <= c < width:
+        if edges[r, c] == 255:
+            return r, c, True
+        # go to the next pixel through the closest row or column line
+        if next_r < next_c:
+            r += step_r
+            next_r += delta_r
+        else:
+            c += step_c
+            next_c += delta_c
+    return r, c, False
+
+
+@njit("Tuple((int64[:, ::1], boolean[::1]))(float64[:], float64[:], float64[:], float64[:], uint8[:, ::1])",
+      cache=True, boundscheck=False, error_model="numpy", parallel=True)
+def _walk_rays(rows, cols, sin_a, cos_a, edges):
+    """
+    Walk several rays, one per (row, col, sin_a, cos_a), and return their first edge pixel [row, col] and if they hit one.
+    """
+    points = np.empty((len(rows), 2), np.int64)
+    hits = np.empty(len(rows), np.bool_)
+    # the rays are independent and each one writes its own row, they are walked in parallel
+    for i in prange(len(rows)):
+        points[i, 0], points[i, 1], hits[i] = _walk_ray(rows[i], cols[i], sin_a[i], cos_a[i], edges)
+    return points, hits
+
+
+def _as_edges(edges: np.ndarray):
+    """
+    The edges as the C-contiguous uint8 mask the ray kernels are compiled for, without copy when it already is one.
+    """
+    return np.ascontiguousarray(edges, dtype=np.uint8)
 
 
-def pt_from(origin: np.ndarray, angle: int, distance):
+def _edge_tuple(row, col, hit):
     """
-    Compute the point [x, y] that is 'distance' apart from the origin point perpendicular.
+    The edge pixel (x, y) found by a ray kernel, an empty tuple when the ray left the image.
     """
-    x = origin[1] + np.sin(angle) * distance
-    y = origin[0] + np.cos(angle) * distance
-    return np.array([int(y), int(x)])
+    return (col, row) if hit else ()
+
+
+def _edge_point(p1, angle_radians, edges: np.ndarray):
+    """
+    The edge pixel (x, y) given a starting point, angle, and image edges, an empty tuple when the ray leaves the image.
+    """
+    return _edge_tuple(*_walk_ray(float(p1[0]), float(p1[1]), math.sin(angle_radians), math.cos(angle_radians),
+                                  _as_edges(edges)))
 
 
 def find_edge(p1: np.ndarray, angle_radians, edges: np.ndarray, save):
     """
     Find the edge pixel given a starting point, angle, and image edges.
     """
-    distance = 0
-    while True:
-        x, y = pt_from(p1, angle_radians, distance)
-        if not (0 <= x < edges.shape[0] and 0 <= y < edges.shape[1]):
-            break
-
-        hit_zone = edges[x, y] == 255
-        if np.any(hit_zone):
-            save.append((y, x))
-            break
-        distance += 0.01
+    point = _edge_point(p1, angle_radians, edges)
+    if point:
+        save.append(point)
     return save
 
 
@@ -45,60 +104,45 @@ def get_max_approx(top_arr, bottom_arr):
         print("Error: Not the same number of points")
         return
 
-    vector = np.array(top_arr) - np.array(bottom_arr)
-    norms = np.linalg.norm(vector, axis=1)
-    max_norm = norms[0]
-    save_index = 0
-
-    for i in range(len(top_arr)):
-        if norms[i] >= max_norm and norms[i] <= norms[0] * 1.5:
-            max_norm = norms[i]
-            save_index = i
-
-    return save_index
+    # the sides already are (n, 2) arrays when they come from the ray kernels, they are not copied
+    vector = np.asarray(top_arr) - np.asarray(bottom_arr)
+    norms = np.hypot(vector[:, 0], vector[:, 1])
+    # a norm above 1.5 times the first one is a detection error and cannot be the maximum
+    norms = np.where(norms <= norms[0] * 1.5, norms, -np.inf)
+    # when several norms are equal to the maximum, the last one is kept
+    return len(norms) - 1 - int(np.argmax(norms[::-1]))
 
 
 def vector_angle(vector: np.ndarray, plus: int):
     """
     Calculate the angle of a vector with an optional offset.
     """
-    angle = np.arctan2(vector[1], vector[0])
-    return angle + np.pi / 2 if plus else angle - np.pi / 2
+    angle = math.atan2(vector[1], vector[0])
+    return angle + math.pi / 2 if plus else angle - math.pi / 2
 
 
 def get_maximum_range(angle_radians, result, edges):
     """
     Get the range of points along a given angle within image boundaries.
     """
-    save = []
-
-    for point in result:
-        distance = 0
-        while True:
-            x, y = pt_from(point, angle_radians, distance)
-            if not (0 <= x < edges.shape[0] and 0 <= y < edges.shape[1]):
-                break
-
-            hit_zone = edges[x, y] == 255
-            if np.any(hit_zone):
-                save.append((y, x))
-                break
-
-            distance += 0.01
-    return save
+    points = np.asarray(result, dtype=float)
+    # every ray has the same angle, its sine and cosine are computed once
+    sin_a, cos_a = np.full(len(points), math.sin(angle_radians)), np.full(len(points), math.cos(angle_radians))
+    found, hits = _walk_rays(points[:, 0], points[:, 1], sin_a, cos_a, _as_edges(edges))
+    return [(col, row) for row, col in found[hits].tolist()]
 
 
 def _get_maximum(start: np.ndarray, end: np.ndarray, edges: np.ndarray, img, angle, is_start: int):
     """
     Get the maximum distance between two edges along a specific angle.
     """
-    p1, p2, vector = get_points(start, end)
-    angle_radians = np.arctan2(vector[1], vector[0]) - angle
-    max1 = find_edge(p1, angle_radians, edges, save=[])
-    angle_radians = (np.arctan2(vector[1], vector[0]) + angle) * is_start
-    max2 = find_edge(p1, angle_radians, edges, save=[])
+    p1 = (start[1], start[0])
+    # the angle of the segment is computed once for both sides
+    base_angle = math.atan2(end[0] - start[0], end[1] - start[1])
+    max1 = find_edge(p1, base_angle - angle, edges, save=[])
+    max2 = find_edge(p1, (base_angle + angle) * is_start, edges, save=[])
     cv.line(img, max1[0], max2[0], (0, 0, 255), 1)
-    return np.linalg.norm(np.array(max1) - np.array(max2))
+    return math.hypot(max1[0][0] - max2[0][0], max1[0][1] - max2[0][1])
 
 
 def max_line(start: np.ndarray, end: np.ndarray, edges: np.ndarray, img: np.ndarray):
@@ -115,78 +159,96 @@ def max_perp(start: np.ndarray, end: np.ndarray, edges: np.ndarray, img: np.ndar
     return _get_maximum(start, end, edges, img, np.pi / 2, 1)
 
 
+def max_perps(segments: list, edges: np.ndarray, img: np.ndarray):
+    """
+    Calculate the maximum perpendicular distance between two edges for several (start, end) segments at once.
+    """
+    starts = np.array([start for start, end in segments], dtype=float)
+    ends = np.array([end for start, end in segments], dtype=float)
+    angles = np.arctan2(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])
+    # the two rays of each segment start from its start point, on each side of it
+    angles = np.concatenate([angles - np.pi / 2, angles + np.pi / 2])
+    rows, cols = np.tile(starts[:, 1], 2), np.tile(starts[:, 0], 2)
+    points, hits = _walk_rays(rows, cols, np.sin(angles), np.cos(angles), _as_edges(edges))
+    if not hits.all():
+        raise IndexError("No edge found on one side of a segment")
+    max1, max2 = points[:len(segments), ::-1], points[len(segments):, ::-1]
+    for point1, point2 in zip(max1, max2):
+        cv.line(img, point1.tolist(), point2.tolist(), (0, 0, 255), 1)
+    return np.hypot(*(max1 - max2).T)
+
+
 def get_max_pt(start, end, edges):
     """
     Get the point where the maximum perpendicular distance occurs between two edges.
     """
     p1, p2, vector = get_points(start, end)
     # create an array with 100 points between start and end
-    x_values = np.linspace(p1[1], p2[1], 100)
-    y_values = np.linspace(p1[0], p2[0], 100)
-    result = [(y, x) for x, y in zip(x_values, y_values)]
-    # set the angle in the direction of the edges
-    angle_radians = vector_angle(vector, 1)
-    r_side = get_maximum_range(angle_radians, result, edges)
-    # set the angle in the direction of other side
-    angle_radians = vector_angle(vector, 0)
-    l_side = get_maximum_range(angle_radians, result, edges)
+    result = np.linspace(p1, p2, 100, dtype=float)
+    # the rays in the direction of the edges and in the direction of the other side are walked in one batch
+    angles = (vector_angle(vector, 1), vector_angle(vector, 0))
+    points = np.tile(result, (2, 1))
+    sin_a, cos_a = np.repeat([math.sin(a) for a in angles], len(result)), np.repeat([math.cos(a) for a in angles], len(result))
+    found, hits = _walk_rays(points[:, 0], points[:, 1], sin_a, cos_a, _as_edges(edges))
+    r_side = found[:len(result)][hits[:len(result)], ::-1]
+    l_side = found[len(result):][hits[len(result):], ::-1]
     # get the index of the max
     index = get_max_approx(r_side, l_side)
+    if index is None:
+        raise IndexError("No edge found on one side of the segment for some points")
     return result[index][::-1]
 
 
-def get_maximum_pit(start: np.ndarray, edges: np.ndarray):
+@njit("UniTuple(Tuple((int64, int64, boolean)), 2)(float64, float64, int64, int64, boolean, float64, uint8[:, ::1])",
+      cache=True, boundscheck=False, error_model="numpy")
+def _turn_ray(row, col, save_r, save_c, save_hit, step, edges):
     """
-    Get the maximum perpendicular distance along both sides of a point.
+    Turn the ray from the angle 0 by step while its edge pixel gets further from the origin of the image, return the
+    last edge pixel (row, col, hit) and the first closer one.
     """
-    point = np.array([start[1], start[0]])
-    point2 = np.array([point[0] + 5, point[1]])
-    vector = np.array([point2[0] - point[0], point2[1] - point[1]])
-    angle_radians = np.arctan2(vector[1], vector[0])
-    max_save = find_edge(point, angle_radians, edges, save=[])
-    # separate left and right to keep the direction for left and right
-    angle_radians_left = angle_radians
-    angle_radians_right = angle_radians
-    max_save_right = max_save
-    max_save_left = max_save
-
+    # the pixels have integer coordinates, their squared norms are compared exactly
+    save_norm = save_r * save_r + save_c * save_c if save_hit else 0
+    angle_radians = 0.0
     while True:
-        angle_radians_left += 0.01
-        max_last_right = find_edge(point, angle_radians_left, edges, save=[])
-        if np.linalg.norm(max_last_right) < np.linalg.norm(max_save_right):
-            break
-        max_save_right = max_last_right
+        angle_radians += step
+        r, c, hit = _walk_ray(row, col, math.sin(angle_radians), math.cos(angle_radians), edges)
+        norm = r * r + c * c if hit else 0
+        if norm < save_norm:
+            return (save_r, save_c, save_hit), (r, c, hit)
+        save_r, save_c, save_hit, save_norm = r, c, hit, norm
 
-    while True:
-        angle_radians_right -= 0.01
-        max_last_left = find_edge(point, angle_radians_right, edges, save=[])
-        if np.linalg.norm(max_last_left) < np.linalg.norm(max_save_left):
-            break
-        max_save_left = max_last_left
 
-    distance = np.linalg.norm(max(max_save_left, max_last_right))
+def get_maximum_pit(start: np.ndarray, edges: np.ndarray):
+    """
+    Get the maximum perpendicular distance along both sides of a point.
+    """
+    edges = _as_edges(edges)
+    row, col = float(start[1]), float(start[0])
+    # start with the ray going down the rows
+    max_save = _walk_ray(row, col, 0.0, 1.0, edges)
+    # separate left and right to keep the direction for left and right, the whole scan of a side runs in the kernel
+    max_save_right, max_last_right = (_edge_tuple(*p) for p in _turn_ray(row, col, *max_save, PIT_STEP, edges))
+    max_save_left, max_last_left = (_edge_tuple(*p) for p in _turn_ray(row, col, *max_save, -PIT_STEP, edges))
+
     point = max(max_save_left, max_last_right)
+    distance = math.hypot(*point)
 
-    return point[0], int(distance)
+    return point, int(distance)
 
 def get_side_nipple(start: np.ndarray, edges: np.ndarray):
-    point = np.array([start[1], start[0]])
-    point2 = np.array([point[0], point[1] + 1])
-    vector = np.array([point2[0] - point[0], point2[1] - point[1]])
-    angle_radians = np.arctan2(vector[1], vector[0])
-    max_save = find_edge(point, angle_radians, edges, save=[])
+    row, col = start[1], start[0]
+    # every ray goes along the row, to the right
+    angle_radians = math.pi / 2
+    max_save = _edge_point((row, col), angle_radians, edges)
     while True:
-        point = np.array([point[0] + 1, start[0]])
-        point2 = np.array([point[0], start[0] + 1])
-        vector = np.array([point2[0] - point[0], point2[1] - point[1]])
-        angle_radians = np.arctan2(vector[1], vector[0])
-        current_max = find_edge(point, angle_radians, edges, save=[])
-        if np.linalg.norm(max_save) < np.linalg.norm(current_max):
+        row += 1
+        current_max = _edge_point((row, col), angle_radians, edges)
+        if math.hypot(*max_save) < math.hypot(*current_max):
             break
         max_save = current_max
-    return max_save[0]
+    return max_save
 
 def get_length(point1: np.ndarray, point2: np.ndarray, image: np.ndarray):
-    length = np.linalg.norm(point1 - point2)
+    length = math.hypot(point1[0] - point2[0], point1[1] - point2[1])
     cv.line(image, point1.astype(int), point2.astype(int), (0, 0, 255), 1)
     return length
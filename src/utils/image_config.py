@@ -1,15 +1,42 @@
 import numpy as np
-import PIL
-from PIL import Image, ImageEnhance
-from rembg import remove
+from PIL import Image
+from rembg import remove, new_session
 import cv2 as cv
 from scipy.ndimage import rotate
 import os
 import glob
+import threading
 
-from src.utils.crop import _crop
+from src.utils.crop import _crop, _first_nonzero
 
 RESIZE_SIZE = 900  # the maximum size of the image to be processed (in pixels)
+SOBEL_THRESHOLD = 30  # the minimum gradient magnitude of an edge in gradient_edges
+GRABCUT_SIZE = 256  # the maximum size of the image segmented by GrabCut (in pixels)
+GRABCUT_MARGIN = 0.05  # the part of the image on each border that is considered as background by GrabCut
+# the images are loaded concurrently, only one of them has to compute the camera calibration
+_calibration_lock = threading.Lock()
+# the rembg model is loaded once and shared by the images
+_rembg_lock = threading.Lock()
+_rembg_session = None
+
+
+def _load_image(im_path: str):
+    """Loads an image as an RGB array, without applying the EXIF orientation like PIL.
+
+    Parameters
+    ----------
+    im_path : str
+        The path of the image.
+
+    Returns
+    -------
+    np.ndarray
+        The RGB image.
+    """
+    image = cv.imread(im_path, cv.IMREAD_COLOR | cv.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise FileNotFoundError(f"No such image: '{im_path}'")
+    return cv.cvtColor(image, cv.COLOR_BGR2RGB)
 
 
 def _resize(im):
@@ -17,28 +44,28 @@ def _resize(im):
 
     Parameters
     ----------
-    im : PIL Image
+    im : np.ndarray
         The image to be resized.
 
     Returns
     -------
-    PIL Image
-        The resized image.
+    np.ndarray
+        The resized image, the given image itself when it is already small enough.
     min_ratio
         The ratio of the resize
     """
-    x_im, y_im = im.height, im.width
+    x_im, y_im = im.shape[:2]
     x_ratio, y_ratio = RESIZE_SIZE / x_im, RESIZE_SIZE / y_im
     min_ratio = min(x_ratio, y_ratio)
     if min_ratio >= 1:
-        return im.copy()
+        return im, 1
     x_resize, y_resize = int(min_ratio * x_im), int(min_ratio * y_im)
-    return im.resize((y_resize, x_resize)), min_ratio
+    return cv.resize(im, (y_resize, x_resize), interpolation=cv.INTER_AREA), min_ratio
 
 
 
-def canny_edges(im: np.ndarray, image: np.ndarray):
-    """ Apply canny to the given image and returns the edges
+def gradient_edges(im: np.ndarray, image: np.ndarray):
+    """ Apply a Sobel gradient threshold to the given image and returns the edges, the measurements use thresh instead
 
     Parameters
     ----------
@@ -47,22 +74,19 @@ def canny_edges(im: np.ndarray, image: np.ndarray):
 
     Returns
     -------
-    PIL Image
-        the edges of the image after canny
+    np.ndarray
+        the edges of the image after the gradient threshold, inner edges included (0 or 255)
     """
     grayscale_image = cv.cvtColor(im, cv.COLOR_BGR2GRAY)
 
-    edged = cv.Canny(grayscale_image, 10, 30)
+    # the background is already removed so a gradient threshold is enough, no need for the hysteresis of Canny
+    gradient = cv.magnitude(cv.Sobel(grayscale_image, cv.CV_32F, 1, 0, ksize=3),
+                            cv.Sobel(grayscale_image, cv.CV_32F, 0, 1, ksize=3))
+    edged = (gradient > SOBEL_THRESHOLD).astype(np.uint8) * 255
     kernel = cv.getStructuringElement(cv.MORPH_RECT, (3, 3))
 
-    # apply the dilation operation to the edged image
-    dilate = cv.dilate(edged, kernel, iterations=1)
-
-    contours, _ = cv.findContours(dilate, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-    edges = np.zeros(image.shape)
-    # draw the contours on a copy of the original image
-    cv.drawContours(edges, contours, -1, (0, 255, 0), 2)
-    return edges
+    # the dilation thickens the edges, the dilated mask is already a single channel mask (0 or 255) for the edge scans
+    return cv.dilate(edged, kernel, iterations=1)
 
 
 def thresh(im: np.ndarray, image: np.ndarray, line_size):
@@ -84,49 +108,85 @@ def thresh(im: np.ndarray, image: np.ndarray, line_size):
 
     # find the contours in the grayscaled image
     contours, _ = cv.findContours(binary_silhouette, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-    edges = np.zeros(image.shape)
-    # draw the contours on a copy of the original image
-    cv.drawContours(edges, contours, -1, (0, 255, 0), line_size)
+    # the edges are a single channel mask (0 or 255), one byte per pixel for the edge scans
+    edges = np.zeros(image.shape[:2], np.uint8)
+    cv.drawContours(edges, contours, -1, 255, line_size)
     cv.drawContours(image, contours, -1, (0, 255, 0), line_size)
     return edges
 
 
+def remove_background(image: np.ndarray, use_rembg: int):
+    """ Remove the background of the image with rembg (U2-Net) or with OpenCV GrabCut
+
+    Parameters
+    ----------
+    image: np.ndarray
+        The RGB image
+    use_rembg: int
+        1 to use rembg, 0 to use GrabCut which does not need a model but is less precise
+
+    Returns
+    -------
+    np.ndarray
+        The RGBA image, the background is black and transparent
+    """
+    global _rembg_session
+    if use_rembg:
+        with _rembg_lock:
+            if _rembg_session is None:
+                _rembg_session = new_session()
+        return remove(image, session=_rembg_session)
+
+    # GrabCut is slow on the full image, it segments a downscaled copy and the mask is scaled back up
+    height, width = image.shape[:2]
+    ratio = min(GRABCUT_SIZE / max(height, width), 1)
+    small = cv.resize(image, (round(width * ratio), round(height * ratio)), interpolation=cv.INTER_AREA)
+    small_height, small_width = small.shape[:2]
+    # the participant is in the middle of the picture so the borders initialise the background model
+    rect = (int(small_width * GRABCUT_MARGIN), int(small_height * GRABCUT_MARGIN),
+            int(small_width * (1 - 2 * GRABCUT_MARGIN)), int(small_height * (1 - 2 * GRABCUT_MARGIN)))
+    mask = np.zeros((small_height, small_width), np.uint8)
+    cv.grabCut(small, mask, rect, np.zeros((1, 65)), np.zeros((1, 65)), 3, cv.GC_INIT_WITH_RECT)
+    foreground = ((mask == cv.GC_FGD) | (mask == cv.GC_PR_FGD)).astype(np.uint8)
+    foreground = cv.resize(foreground, (width, height), interpolation=cv.INTER_NEAREST)
+    return np.dstack([image * foreground[:, :, None], foreground * 255])
+
+
 def calibrate_image(im):
     chessboard_size = (5, 5)  # Change this to match your pattern
-    if not os.path.exists("camera_calibration.npz"):
-        chessboard_imgs = glob.glob('img/chessboard/*.jpg')
-        if (len(chessboard_imgs) == 0):
-            print("You need a chessboards folder with images with chessboard in it")
-        criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
-        obj_points = []
-        img_points = []
-
-        objp = np.zeros((chessboard_size[0] * chessboard_size[1], 3), np.float32)
-        objp[:, :2] = np.mgrid[0:chessboard_size[0], 0:chessboard_size[1]].T.reshape(-1, 2)
-        for fname in chessboard_imgs:
-            pil_im = PIL.Image.open(fname).convert('RGB')
-            pil_im, min_ratio = _resize(pil_im)
-            img = np.asarray(pil_im)
-            gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-            ret, corners = cv.findChessboardCorners(gray, chessboard_size, None)
-            if ret:
-                obj_points.append(objp)
-                corners2 = cv.cornerSubPix(gray, corners, (5, 5), (-1, -1), criteria)
-                img_points.append(corners2 / min_ratio)
-            else:
-                print("one not found")
-
-        ret, mtx, dist, rvecs, tvecs = cv.calibrateCamera(obj_points, img_points, gray.shape[::-1], None, None)
-        np.savez('camera_calibration.npz', mtx=mtx, dist=dist, rvecs=rvecs, tvecs=tvecs)
-    else:
-        calibration_data = np.load('camera_calibration.npz')
-        mtx, dist, rvecs, tvecs = calibration_data['mtx'], calibration_data['dist'], calibration_data['rvecs'], calibration_data['tvecs']
+    with _calibration_lock:
+        if not os.path.exists("camera_calibration.npz"):
+            chessboard_imgs = glob.glob('img/chessboard/*.jpg')
+            if (len(chessboard_imgs) == 0):
+                print("You need a chessboards folder with images with chessboard in it")
+            criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+            obj_points = []
+            img_points = []
+
+            objp = np.zeros((chessboard_size[0] * chessboard_size[1], 3), np.float32)
+            objp[:, :2] = np.mgrid[0:chessboard_size[0], 0:chessboard_size[1]].T.reshape(-1, 2)
+            for fname in chessboard_imgs:
+                img, min_ratio = _resize(_load_image(fname))
+                gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+                ret, corners = cv.findChessboardCorners(gray, chessboard_size, None)
+                if ret:
+                    obj_points.append(objp)
+                    corners2 = cv.cornerSubPix(gray, corners, (5, 5), (-1, -1), criteria)
+                    img_points.append(corners2 / min_ratio)
+                else:
+                    print("one not found")
+
+            ret, mtx, dist, rvecs, tvecs = cv.calibrateCamera(obj_points, img_points, gray.shape[::-1], None, None)
+            np.savez('camera_calibration.npz', mtx=mtx, dist=dist, rvecs=rvecs, tvecs=tvecs)
+        else:
+            calibration_data = np.load('camera_calibration.npz')
+            mtx, dist, rvecs, tvecs = calibration_data['mtx'], calibration_data['dist'], calibration_data['rvecs'], calibration_data['tvecs']
     h, w = im.shape[:2]
     newcameramtx, roi = cv.getOptimalNewCameraMatrix(mtx, dist, (w, h), 1, (w, h))
     undist = cv.undistort(im, mtx, dist, None, newcameramtx)
     return undist
 
-def create_resize_remove_im_front(im_path: str, calibration: int, rotation: int, luminosity):
+def create_resize_remove_im_front(im_path: str, calibration: int, rotation: int, luminosity, use_rembg: int = 1):
     """
     Take and image path and return image without background, resized and the pil version
     Parameters
@@ -134,37 +194,36 @@ def create_resize_remove_im_front(im_path: str, calibration: int, rotation: int,
     calibration : int
     rotation : int
     im_path: str
+    use_rembg : int
 
     Returns
     -------
     PIL Image
     """
-    pil_im = PIL.Image.open(im_path).convert("RGB")
+    original_image = _load_image(im_path)
     if luminosity:
-        img_enhancer = ImageEnhance.Brightness(pil_im)
         factor = 1.5
-        pil_im = img_enhancer.enhance(factor)
-    original_image = np.asarray(pil_im)
-    pil_im, min_ratio = _resize(pil_im)
-    image_resized = np.asarray(pil_im)
-    im = remove(image_resized)
+        original_image = cv.convertScaleAbs(original_image, alpha=factor)
+    image_resized, min_ratio = _resize(original_image)
+    pil_im = Image.fromarray(image_resized)
+    im = remove_background(image_resized, use_rembg)
     if rotation:
         im = rotate(im, -90, reshape=True, mode='nearest')
         image_resized = rotate(image_resized, -90, reshape=True, mode='nearest')
         original_image = rotate(original_image, -90, reshape=True, mode='nearest')
     if calibration:
         original_image = calibrate_image(original_image)
-        original_pil_image = Image.fromarray(original_image)
-        original_pil_image.save("t.jpg")
-        image_resized, min_ratio2 = _resize(original_pil_image)
-        image_resized = np.asarray(image_resized)
-        im = remove(image_resized)
+        image_resized, min_ratio2 = _resize(original_image)
+        im = remove_background(image_resized, use_rembg)
         pil_im = Image.fromarray(image_resized)
     else:
         pil_im = pil_im.transpose(Image.ROTATE_270)
+    if image_resized is original_image:
+        # the resized image is drawn on, the original one has to stay clean for the chessboards
+        original_image = original_image.copy()
     return pil_im, image_resized, im, original_image, min_ratio
 
-def create_resize_remove_im(im_path: str, calibration: int, rotation: int):
+def create_resize_remove_im(im_path: str, calibration: int, rotation: int, use_rembg: int = 1):
     """
     Take and image path and return image without background, resized and the pil version
     Parameters
@@ -172,43 +231,42 @@ def create_resize_remove_im(im_path: str, calibration: int, rotation: int):
     calibration : int
     rotation : int
     im_path: str
+    use_rembg : int
 
     Returns
     -------
     PIL Image
     """
-    pil_im = PIL.Image.open(im_path).convert("RGB")
-    original_image = np.asarray(pil_im)
-    pil_im, min_ratio = _resize(pil_im)
-    image_resized = np.asarray(pil_im)
-    im = remove(image_resized)
+    original_image = _load_image(im_path)
+    image_resized, min_ratio = _resize(original_image)
+    pil_im = Image.fromarray(image_resized)
+    im = remove_background(image_resized, use_rembg)
     if rotation:
         im = rotate(im, -90, reshape=True, mode='nearest')
         image_resized = rotate(image_resized, -90, reshape=True, mode='nearest')
         original_image = rotate(original_image, -90, reshape=True, mode='nearest')
     if calibration:
         original_image = calibrate_image(original_image)
-        original_pil_image = Image.fromarray(original_image)
-        original_pil_image.save("t.jpg")
-        image_resized, min_ratio2 = _resize(original_pil_image)
-        image_resized = np.asarray(image_resized)
-        im = remove(image_resized)
+        image_resized, min_ratio2 = _resize(original_image)
+        im = remove_background(image_resized, use_rembg)
         pil_im = Image.fromarray(image_resized)
     else:
         pil_im = pil_im.transpose(Image.ROTATE_270)
+    if image_resized is original_image:
+        # the resized image is drawn on, the original one has to stay clean for the chessboards
+        original_image = original_image.copy()
     return pil_im, image_resized, im, original_image, min_ratio
 
 
 def better_edges(edges: np.ndarray, data: np.ndarray):
     crotch_zone = _crop(edges, data[12], data[13])
-    height = np.array(
-        [np.where(crotch_zone != 0)[1][0], np.where(crotch_zone != 0)[0][1]]
-    )
+    first, second = _first_nonzero(crotch_zone, 2)
+    height = np.array([first[1], second[0]])
     crotch = np.array([round(data[12][0] + height[0]), round(data[12][1] + height[1])])
     crotch_approx = np.array(
         [round(data[12][0] + height[0]), round(data[12][1] + height[1] - 5)]
     )
-    cv.line(edges, crotch, crotch_approx, (0, 255, 0), 7)
+    cv.line(edges, crotch, crotch_approx, 255, 7)
     return edges
 
 